@@ -41,7 +41,8 @@ if drawing1 and drawing2:
 
             with st.spinner("Running validation..."):
                 output_bytes, summary, debug_df = verify_drawings_memory(
-                    drawing1, drawing2, mapping_csv, progress_callback=update_progress
+                    drawing1.getvalue(), drawing2.getvalue(), mapping_csv,
+                    progress_callback=update_progress,
                 )
 
             progress_bar.progress(100)
@@ -1,16 +1,28 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 import fitz
+import numpy as np
 import pandas as pd
 
+# Recently extracted drawings, keyed by a BLAKE2b digest of the PDF bytes
+_CACHE_SIZE = 8
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
 
-def extract_text_positions(pdf_bytes):
+def extract_text_positions(pdf_source):
     """
     Extracts all visible text and its coordinates from a PDF file (in memory).
     Uses PyMuPDF, which is reliable for engineering drawings with embedded text.
 
     Parameters
     ----------
-    pdf_bytes : bytes
-        Raw PDF bytes loaded from an uploaded file (Streamlit or local).
+    pdf_source : bytes or fitz.Document
+        Raw PDF bytes loaded from an uploaded file (Streamlit or local), or
+        an already opened document. An opened document is left open so the
+        caller can keep using it (e.g. for annotation) without re-parsing.
 
     Returns
     -------
@@ -18,32 +30,83 @@ def extract_text_positions(pdf_bytes):
         Columns: ['page', 'x0', 'y0', 'x1', 'y1', 'text']
         - page : Page number (1-based)
         - x0,y0,x1,y1 : Bounding box of text (in points)
-        - text : Actual extracted text string
+        - text : Actual extracted text string (categorical)
     """
+    if isinstance(pdf_source, fitz.Document):
+        return _words_df(pdf_source)
 
     # Open PDF directly from memory (no need to save to disk)
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    records = []
+    doc = fitz.open(stream=pdf_source, filetype="pdf")
+    try:
+        return _words_df(doc)
+    finally:
+        doc.close()
+
+
+def extract_text_positions_cached(pdf_bytes, doc=None):
+    """
+    Same as extract_text_positions, memoized on the PDF content so that
+    re-running a validation on the same upload skips extraction.
+
+    Parameters
+    ----------
+    pdf_bytes : bytes or file-like
+        Raw PDF bytes (or an object with getvalue(), e.g. a Streamlit upload).
+    doc : fitz.Document, optional
+        The same PDF already opened by the caller; used on a cache miss
+        instead of parsing pdf_bytes again.
+
+    Returns
+    -------
+    pd.DataFrame
+        A copy of the cached frame, safe for the caller to modify.
+    """
+    if hasattr(pdf_bytes, "getvalue"):
+        pdf_bytes = pdf_bytes.getvalue()
+    key = hashlib.blake2b(pdf_bytes, digest_size=16).digest()
+
+    with _cache_lock:
+        df = _cache.get(key)
+        if df is not None:
+            _cache.move_to_end(key)
+            return df.copy()
+
+    df = extract_text_positions(doc if doc is not None else pdf_bytes)
+
+    with _cache_lock:
+        _cache[key] = df
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return df.copy()
+
+
+def _words_df(doc):
+    """Collect word boxes from every page of an open document."""
+    # Accumulate columns directly instead of one dict per word
+    pages, x0s, y0s, x1s, y1s, texts = [], [], [], [], [], []
 
     for page_no, page in enumerate(doc, start=1):
-        # Get all word-level text boxes
+        # Get all word-level text boxes, dropping blank ones
         # Each entry: (x0, y0, x1, y1, "word", block_no, line_no, word_no)
-        words = page.get_text("words")
-
-        for w in words:
-            x0, y0, x1, y1, text, *_ = w
-            text = text.strip()
-            if not text:
-                continue
-
-            records.append({
-                "page": page_no,
-                "x0": x0,
-                "y0": y0,
-                "x1": x1,
-                "y1": y1,
-                "text": text
-            })
-
-    doc.close()
-    return pd.DataFrame(records)
+        words = [w for w in page.get_text("words") if w[4] and not w[4].isspace()]
+        if not words:
+            continue
+
+        # Words are already split on whitespace, so no per-word strip()
+        cols = list(zip(*words))
+        pages.extend([page_no] * len(words))
+        x0s.extend(cols[0])
+        y0s.extend(cols[1])
+        x1s.extend(cols[2])
+        y1s.extend(cols[3])
+        texts.extend(cols[4])
+
+    return pd.DataFrame({
+        "page": np.asarray(pages, dtype=np.int16),
+        "x0": np.asarray(x0s, dtype=np.float32),
+        "y0": np.asarray(y0s, dtype=np.float32),
+        "x1": np.asarray(x1s, dtype=np.float32),
+        "y1": np.asarray(y1s, dtype=np.float32),
+        # Drawings repeat the same words a lot; categories store each once
+        "text": pd.Categorical(texts),
+    })
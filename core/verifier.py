@@ -1,58 +1,208 @@
 import fitz
+import numpy as np
 import pandas as pd
+import functools
 import json
 import io
-from rapidfuzz import fuzz
-from core.extractor import extract_text_positions
+import os
+import re
+from collections import defaultdict
+from rapidfuzz import fuzz, process
+from scipy.spatial import cKDTree
+from core.extractor import extract_text_positions_cached
 
 
 # ---------------- SETTINGS LOADER ----------------
 def load_settings(config_path="config/settings.json"):
     """Load tolerance, prefix, and scaling settings from JSON file."""
+    # Parsed once per file version; the copy keeps callers off the cache
+    return dict(_load_settings_cached(str(config_path), os.path.getmtime(config_path)))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_settings_cached(config_path, mtime):
     with open(config_path, "r") as f:
         return json.load(f)
 
 
+def load_mapping(mapping_csv):
+    """
+    Load the Drawing1_No -> Drawing2_No mapping (stripped, upper-cased).
+    Paths are cached per file version like settings; file-like sources
+    are read every time.
+    """
+    if isinstance(mapping_csv, (str, os.PathLike)):
+        return dict(_load_mapping_cached(str(mapping_csv), os.path.getmtime(mapping_csv)))
+    return _read_mapping(mapping_csv)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_mapping_cached(mapping_csv, mtime):
+    return _read_mapping(mapping_csv)
+
+
+def _read_mapping(mapping_csv):
+    df_map = pd.read_csv(
+        mapping_csv,
+        usecols=["Drawing1_No", "Drawing2_No"],
+        dtype={"Drawing1_No": "string", "Drawing2_No": "string"},
+    ).dropna()
+    return dict(zip(
+        df_map["Drawing1_No"].str.strip().str.upper().to_numpy(),
+        df_map["Drawing2_No"].str.strip().str.upper().to_numpy(),
+    ))
+
+
+# ---------------- INPUT LOADER ----------------
+def _pdf_bytes(pdf):
+    """Return raw PDF bytes from bytes or a file-like upload (e.g. Streamlit)."""
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        return bytes(pdf)
+    if hasattr(pdf, "getvalue"):
+        return pdf.getvalue()
+    return pdf.read()
+
+
+def _normalize_word(text):
+    return text.strip().upper()
+
+
 # ---------------- CONTEXT BUILDER ----------------
-def build_context(df, radius=250):
+def build_context(df, radius=250, prefix=None):
     """
     Build local text context for each detected text region.
     This helps compare same logical areas between drawings.
+    Neighbours (|dx| and |dy| within radius) are found per page with a
+    KD-tree range query, so dense pages stay O(N log N).
+    With `prefix`, only regions whose text starts with it are returned;
+    their neighbours are still taken from every word on the page.
+    Expects "text" already stripped and upper-cased.
     """
-    contexts = []
-    for _, tag in df.iterrows():
-        same_page = df[df["page"] == tag["page"]]
-        neighbors = same_page[
-            (abs(same_page["x0"] - tag["x0"]) <= radius)
-            & (abs(same_page["y0"] - tag["y0"]) <= radius)
-        ]
-        context_words = " ".join(neighbors["text"].tolist())
-        contexts.append({
-            "page": tag["page"],
-            "text": tag["text"].upper(),
-            "context": context_words.upper(),
-            "x0": tag["x0"],
-            "y0": tag["y0"],
-            "x1": tag["x1"],
-            "y1": tag["y1"]
-        })
-    return pd.DataFrame(contexts)
+    texts = df["text"].to_numpy(dtype=object)
+    points = df[["x0", "y0"]].to_numpy(dtype=np.float64)
+    if prefix is None:
+        is_anchor = np.ones(len(df), dtype=bool)
+    else:
+        prefix = prefix.upper()
+        is_anchor = np.fromiter(
+            (t.startswith(prefix) for t in texts), dtype=bool, count=len(texts)
+        )
+    contexts = np.empty(len(df), dtype=object)
+
+    for pos in df.groupby("page", sort=False).indices.values():
+        anchors = pos[is_anchor[pos]]
+        if len(anchors) == 0:
+            continue
+        tree = cKDTree(points[pos])
+        neighbors = tree.query_ball_point(
+            points[anchors], r=radius, p=np.inf, return_sorted=True
+        )
+        page_texts = texts[pos]
+        contexts[anchors] = [" ".join(page_texts[idx]) for idx in neighbors]
+
+    return pd.DataFrame({
+        "page": df["page"].to_numpy()[is_anchor],
+        "text": texts[is_anchor],
+        "context": contexts[is_anchor],
+        "x0": df["x0"].to_numpy()[is_anchor],
+        "y0": df["y0"].to_numpy()[is_anchor],
+        "x1": df["x1"].to_numpy()[is_anchor],
+        "y1": df["y1"].to_numpy()[is_anchor],
+    })
 
 
 # ---------------- CONTEXT MATCHER ----------------
-def find_best_context_region(src_context, df2_ctx, threshold=75):
+def find_best_context_regions(src_contexts, df2_ctx, threshold=75, progress=None):
     """
-    Compare a context region from Drawing 1 against Drawing 2 contexts
-    using fuzzy matching. Returns the best-matching region.
+    Compare context regions from Drawing 1 against all Drawing 2 contexts
+    using fuzzy matching, scored in batched rapidfuzz calls.
+    Returns the best-matching df2_ctx position per source context
+    (-1 when below threshold) and its score.
+    `progress(n)` is called after each batch with the number of source
+    contexts it finished.
     """
-    best_row, best_score = None, 0
-    for _, cand in df2_ctx.iterrows():
-        score = fuzz.partial_ratio(src_context, cand["context"])
-        if score > best_score:
-            best_row, best_score = cand, score
-    if best_row is not None and best_score >= threshold:
-        return best_row, best_score
-    return None, best_score
+    n = len(src_contexts)
+    if n == 0 or df2_ctx.empty:
+        if progress is not None:
+            progress(n)
+        return np.full(n, -1), np.zeros(n)
+
+    # Repeated contexts (title blocks, headers) are scored once and scattered back
+    codes, unique_ctx = pd.factorize(np.asarray(src_contexts, dtype=object))
+    on_batch = None
+    if progress is not None:
+        counts = np.bincount(codes, minlength=len(unique_ctx))
+        on_batch = lambda done: progress(int(counts[done].sum()))
+    unique_pos, unique_score = _best_context_scores(
+        unique_ctx.tolist(), df2_ctx["context"].tolist(), on_batch=on_batch
+    )
+    best_pos, best_score = unique_pos[codes], unique_score[codes]
+    best_pos[best_score < threshold] = -1
+    return best_pos, best_score
+
+
+def _best_context_scores(queries, choices, batch_size=256, on_batch=None):
+    """
+    Best fuzz.partial_ratio match per query: (choice positions, uint8 scores).
+    Queries are scored against every choice in row chunks of batch_size,
+    which bounds the score matrix; `on_batch(query_positions)` is called
+    after each chunk.
+    """
+    best_pos = np.zeros(len(queries), dtype=np.int64)
+    best_score = np.zeros(len(queries), dtype=np.uint8)
+    for start in range(0, len(queries), batch_size):
+        rows = np.arange(start, min(start + batch_size, len(queries)))
+        scores = process.cdist(
+            queries[start:rows[-1] + 1],
+            choices,
+            scorer=fuzz.partial_ratio,
+            workers=-1,
+            dtype=np.uint8,
+        )
+        # argmax keeps the first region on ties, as extractOne did
+        best_pos[rows] = scores.argmax(axis=1)
+        best_score[rows] = scores[np.arange(len(rows)), best_pos[rows]]
+        if on_batch is not None:
+            on_batch(rows)
+    return best_pos, best_score
+
+
+def find_containing_context_regions(src_contexts, src_pages, expected_rhls, df2_ctx, threshold=75):
+    """
+    Exact first round before fuzzy matching: among Drawing 2 regions whose
+    context literally contains the expected RHL, pick the one most similar
+    to the source context, preferring regions on the tag's own page.
+    Returns df2_ctx positions (-1 when no containing region reaches
+    threshold) and whole-number scores, like the fuzzy round.
+    """
+    n = len(src_contexts)
+    best_pos, best_score = np.full(n, -1), np.zeros(n)
+    contexts2 = df2_ctx["context"]
+    pages2 = df2_ctx["page"].to_numpy()
+    choices = contexts2.tolist()
+    containing = {}  # expected RHL -> positions of regions containing it
+
+    for k, (src, page, rhl) in enumerate(zip(src_contexts, src_pages, expected_rhls)):
+        if rhl not in containing:
+            containing[rhl] = np.flatnonzero(
+                contexts2.str.contains(rhl, regex=False).to_numpy(dtype=bool)
+            )
+        cands = containing[rhl]
+        same_page = cands[pages2[cands] == page]
+        # Tag's own page first, then any page
+        groups = [same_page] if len(same_page) == len(cands) else [same_page, cands]
+        for group in groups:
+            if len(group) == 0:
+                continue
+            _, score, idx = process.extractOne(
+                src, [choices[c] for c in group], scorer=fuzz.partial_ratio
+            )
+            # Halves round up, as in the uint8 cdist of the fuzzy round
+            score = int(score + 0.5)
+            if score >= threshold:
+                best_pos[k], best_score[k] = group[idx], score
+                break
+    return best_pos, best_score
 
 
 # ---------------- MAIN VALIDATION LOGIC ----------------
@@ -70,99 +220,157 @@ def verify_drawings_memory(
     """
     settings = load_settings(config_path)
     prefix_5ad = settings.get("scan_prefix", "5-AD")
+    prefix_rhl = settings.get("match_prefix", "RHL-").upper()
 
     # Load mapping
-    df_map = pd.read_csv(mapping_csv)
-    map_dict = {
-        str(row["Drawing1_No"]).strip().upper(): str(row["Drawing2_No"]).strip().upper()
-        for _, row in df_map.iterrows()
-    }
+    map_dict = load_mapping(mapping_csv)
+
+    # Read both uploads once; Drawing 2 is parsed once from those bytes and
+    # reused for extraction and annotation
+    drawing1_data = _pdf_bytes(drawing1_bytes)
+    drawing2_data = _pdf_bytes(drawing2_bytes)
+    doc2 = fitz.open(stream=drawing2_data, filetype="pdf")
+
+    try:
+        # Extract text and positions from both PDFs (cached per PDF content)
+        df1 = extract_text_positions_cached(drawing1_data)
+        df2 = extract_text_positions_cached(drawing2_data, doc=doc2)
+
+        # Normalize text once; everything downstream compares upper-case.
+        # On the categorical text column this runs once per distinct word.
+        df1["text"] = df1["text"].map(_normalize_word)
+        df2["text"] = df2["text"].map(_normalize_word)
+
+        # Build local text context around 5-AD numbers in Drawing 1 and
+        # around every word in Drawing 2, so any region stays a candidate
+        df1_targets = build_context(df1, prefix=prefix_5ad)
+        df2_ctx = build_context(df2)
+
+        df1_targets = df1_targets.assign(
+            expected_rhl=df1_targets["text"].map(map_dict).fillna("")
+        )
+        total = len(df1_targets)
+
+        # Find the most similar context region in Drawing 2 for every mapped tag:
+        # regions containing the expected RHL first, fuzzy search for the rest
+        best_pos = np.full(total, -1)
+        best_score = np.zeros(total)
+        is_mapped = (df1_targets["expected_rhl"] != "").to_numpy()
+        mapped_ctx = df1_targets["context"].to_numpy()[is_mapped]
+        mapped_rhl = df1_targets["expected_rhl"].to_numpy()[is_mapped]
+        mapped_page = df1_targets["page"].to_numpy()[is_mapped]
+        mapped_pos, mapped_score = find_containing_context_regions(
+            mapped_ctx, mapped_page, mapped_rhl, df2_ctx
+        )
+        fuzzy = mapped_pos < 0
+
+        # Progress follows the fuzzy scoring, the slow part; unmapped tags and
+        # exact hits are already resolved at this point
+        done = 0
 
-    # Extract text and positions from both PDFs
-    df1 = extract_text_positions(drawing1_bytes)
-    df2 = extract_text_positions(drawing2_bytes)
-
-    # Build local text context around each tag
-    df1_ctx = build_context(df1)
-    df2_ctx = build_context(df2)
-
-    # Find 5-AD numbers in Drawing 1
-    df1_targets = df1_ctx[df1_ctx["text"].str.startswith(prefix_5ad, na=False)]
-    total = len(df1_targets)
-
-    # Prepare Drawing 2 for annotation
-    doc2 = fitz.open(stream=drawing2_bytes, filetype="pdf")
-
-    matched = mismatched = missing = unmapped = 0
-    debug_rows = []
-
-    for i, row in enumerate(df1_targets.itertuples(), start=1):
-        tag_5ad = row.text
-        expected_rhl = map_dict.get(tag_5ad)
-        color = (0.53, 0.81, 0.92)  # Azure (unmapped/missing default)
-        result = "Unmapped"
-        found_rhl = "-"
-        confidence = 0
-        rect = fitz.Rect(row.x0 - 1, row.y0 - 1, row.x1 + 1, row.y1 + 1)
-
-        if expected_rhl:
-            # Find the most similar context region in Drawing 2
-            best_row, score = find_best_context_region(row.context, df2_ctx)
-            confidence = score
-            if best_row is not None:
-                region_text = best_row.context
-                if expected_rhl in region_text:
-                    # ✅ Matched
-                    color = (0, 1, 0)
-                    result = "Matched"
-                    matched += 1
-                    found_rhl = expected_rhl
-                    rect = fitz.Rect(best_row.x0, best_row.y0, best_row.x1, best_row.y1)
-                elif "RHL-" in region_text:
-                    # ❌ Mismatched
-                    color = (1, 0, 0)
-                    result = "Mismatched"
-                    mismatched += 1
-                    try:
-                        found_rhl = "RHL-" + region_text.split("RHL-")[1].split()[0]
-                    except IndexError:
-                        found_rhl = "RHL-???"
-                    rect = fitz.Rect(best_row.x0, best_row.y0, best_row.x1, best_row.y1)
+        def report(n):
+            nonlocal done
+            done += n
+            if progress_callback and total:
+                progress_callback(done, total)
+
+        report(total - int(fuzzy.sum()))
+        mapped_pos[fuzzy], mapped_score[fuzzy] = find_best_context_regions(
+            mapped_ctx[fuzzy].tolist(), df2_ctx, progress=report
+        )
+        best_pos[is_mapped], best_score[is_mapped] = mapped_pos, mapped_score
+
+        # Drawing 2 regions as plain arrays; the tag loop does no pandas row access
+        ctx2_page = df2_ctx["page"].to_numpy()
+        ctx2_context = df2_ctx["context"].to_numpy()
+        ctx2_text = df2_ctx["text"].to_numpy()
+        ctx2_box = df2_ctx[["x0", "y0", "x1", "y1"]].to_numpy(dtype=np.float64)
+        rhl_token = re.compile(rf"{re.escape(prefix_rhl)}\S*")
+
+        matched = mismatched = missing = unmapped = 0
+        debug_rows = []
+        highlights = defaultdict(lambda: defaultdict(list))  # page -> color -> [fitz.Rect]
+
+        # Drawing 1 tags as plain column arrays, indexed by position in the loop
+        tag_page = df1_targets["page"].to_numpy()
+        tag_text = df1_targets["text"].to_numpy()
+        tag_rhl = df1_targets["expected_rhl"].to_numpy()
+        tag_box = df1_targets[["x0", "y0", "x1", "y1"]].to_numpy(dtype=np.float64) + [-1, -1, 1, 1]
+
+        for k in range(total):
+            tag_5ad = tag_text[k]
+            expected_rhl = tag_rhl[k]
+            color = (0.53, 0.81, 0.92)  # Azure (unmapped/missing default)
+            result = "Unmapped"
+            found_rhl = "-"
+            confidence = 0
+            page = tag_page[k]
+            rect = fitz.Rect(tag_box[k].tolist())
+
+            if expected_rhl:
+                confidence = best_score[k]
+                j = best_pos[k]
+                if j >= 0:
+                    region_text = ctx2_context[j]
+                    if expected_rhl in region_text:
+                        # ✅ Matched
+                        color = (0, 1, 0)
+                        result = "Matched"
+                        matched += 1
+                        found_rhl = expected_rhl
+                    elif prefix_rhl in region_text:
+                        # ❌ Mismatched
+                        color = (1, 0, 0)
+                        result = "Mismatched"
+                        mismatched += 1
+                        # The region's own tag; a region anchored on some
+                        # other word reports the first RHL inside it
+                        found_rhl = ctx2_text[j]
+                        if not found_rhl.startswith(prefix_rhl):
+                            found_rhl = rhl_token.search(region_text).group(0)
+                    else:
+                        # 🔍 Missing in context
+                        result = "Missing"
+                        missing += 1
+
+                    if result != "Missing":
+                        # Highlight the matched region itself
+                        page = ctx2_page[j]
+                        rect = fitz.Rect(ctx2_box[j].tolist())
                 else:
-                    # 🔍 Missing in context
                     result = "Missing"
                     missing += 1
             else:
-                result = "Missing"
-                missing += 1
-        else:
-            unmapped += 1
-
-        # Draw colored rectangle on Drawing 2
-        page_obj = doc2.load_page(row.page - 1)
-        ann = page_obj.add_rect_annot(rect)
-        ann.set_colors(stroke=color, fill=color)
-        ann.set_opacity(0.4)
-        ann.update()
-
-        # Debug log entry
-        debug_rows.append({
-            "5-AD Number": tag_5ad,
-            "Expected RHL": expected_rhl or "-",
-            "Found RHL": found_rhl,
-            "Confidence": round(confidence, 1),
-            "Result": result
-        })
-
-        # Progress bar update
-        if progress_callback:
-            progress_callback(i, total)
-
-    # Save annotated PDF in memory
-    output_stream = io.BytesIO()
-    doc2.save(output_stream)
-    doc2.close()
-    output_stream.seek(0)
+                unmapped += 1
+
+            # Queue colored rectangle for Drawing 2
+            highlights[page][color].append(rect)
+
+            # Debug log entry
+            debug_rows.append({
+                "5-AD Number": tag_5ad,
+                "Expected RHL": expected_rhl or "-",
+                "Found RHL": found_rhl,
+                "Confidence": round(float(confidence), 1),
+                "Result": result
+            })
+
+        # Draw each page's highlights as a single shape (one path per color)
+        # committed once, instead of one annotation and update per tag
+        for page_no, groups in highlights.items():
+            shape = doc2.load_page(int(page_no) - 1).new_shape()
+            for color, rects in groups.items():
+                for rect in rects:
+                    shape.draw_rect(rect)
+                shape.finish(color=color, fill=color, stroke_opacity=0.4, fill_opacity=0.4)
+            shape.commit()
+
+        # Save annotated PDF in memory
+        output_stream = io.BytesIO()
+        doc2.save(output_stream, garbage=3, deflate=True, clean=True)
+        output_stream.seek(0)
+    finally:
+        doc2.close()
 
     # Create summary and debug table
     summary = {
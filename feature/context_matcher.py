@@ -1,30 +1,45 @@
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
 
 def build_context(df, target_prefix, radius=100):
     """
     Build text context windows around each target tag.
     Returns DataFrame with tag text and surrounding words.
+    Neighbours come from one KD-tree per page, queried for all targets at once.
     """
-    contexts = []
-    for i, tag in df[df["text"].str.startswith(target_prefix, na=False)].iterrows():
-        # texts nearby in distance 'radius'
-        same_page = df[df["page"] == tag["page"]]
-        neighbors = same_page[
-            (abs(same_page["x0"] - tag["x0"]) <= radius)
-            & (abs(same_page["y0"] - tag["y0"]) <= radius)
-        ]
-        context_words = " ".join(neighbors["text"].tolist())
-        contexts.append({"text": tag["text"], "context": context_words})
-    return pd.DataFrame(contexts)
+    texts = df["text"].to_numpy(dtype=object)
+    points = df[["x0", "y0"]].to_numpy(dtype=np.float64)
+    is_target = df["text"].str.startswith(target_prefix, na=False).to_numpy(dtype=bool)
+    contexts = np.empty(len(df), dtype=object)
 
-def find_best_match(tag_row, df_context2, threshold=75):
+    for pos in df.groupby("page", sort=False).indices.values():
+        page_targets = pos[is_target[pos]]
+        if len(page_targets) == 0:
+            continue
+        # texts nearby in distance 'radius' (|dx| and |dy|, i.e. p=inf)
+        tree = cKDTree(points[pos])
+        neighbors = tree.query_ball_point(
+            points[page_targets], r=radius, p=np.inf, return_sorted=True
+        )
+        page_texts = texts[pos]
+        contexts[page_targets] = [" ".join(page_texts[idx]) for idx in neighbors]
+
+    return pd.DataFrame({"text": texts[is_target], "context": contexts[is_target]})
+
+def find_best_match(tag_row, df_context2, threshold=75, choices=None):
     """
     Compare one tag + context from Drawing 1 against all from Drawing 2.
+    Returns (best_row, score), or (None, 0) when nothing reaches threshold.
+    Pass `choices` (df_context2["context"].tolist()) when calling in a loop.
     """
-    best_row, best_score = None, 0
-    for _, cand in df_context2.iterrows():
-        score = fuzz.partial_ratio(tag_row["context"], cand["context"])
-        if score > best_score:
-            best_row, best_score = cand, score
-    return best_row, best_score if best_score >= threshold else (None, 0)
+    if choices is None:
+        choices = df_context2["context"].tolist()
+    best = process.extractOne(
+        tag_row["context"], choices, scorer=fuzz.partial_ratio, score_cutoff=threshold
+    )
+    if best is None:
+        return None, 0
+    _, score, idx = best
+    return df_context2.iloc[idx], score
@@ -1,7 +1,18 @@
+import warnings
 from pathlib import Path
 
 def save_uploaded_file(uploaded_file, filename):
-    """Save a Streamlit-uploaded file to disk."""
+    """
+    Save a Streamlit-uploaded file to disk.
+    Deprecated: verify_drawings_memory takes the upload's bytes directly,
+    so there is no need for a disk round trip.
+    """
+    warnings.warn(
+        "save_uploaded_file is deprecated; pass uploaded_file.getvalue() "
+        "to verify_drawings_memory instead.",
+        DeprecationWarning,
+        stacklevel=2,
+    )
     path = Path(filename)
     path.write_bytes(uploaded_file.getvalue())
     return path